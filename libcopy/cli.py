@@ -0,0 +1,199 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line interface of copy."""
+
+# standard imports
+import argparse
+import sys
+
+from os.path import basename
+
+# local imports
+from . import VERSION
+from .filters import parse_group, parse_time, parse_types, parse_user
+from .helpers import parse_count, parse_filesize
+from .walk import L_FOLLOW_TOP, L_FOLLOW_ALL, L_PRESERVE
+from .walk import O_NONE, O_INODE, O_PHYSICAL, O_SIZE
+
+PROG = basename(sys.argv[0])
+
+ORDERS = {  'none'      : O_NONE,
+            'inode'     : O_INODE,
+            'physical'  : O_PHYSICAL,
+            'size'      : O_SIZE }
+
+def main(argv=None):
+    """Runs copy with the command line arguments argv and returns the exit code."""
+    
+    usage = '%(prog)s [OPTIONS] SOURCE... DEST\n       %(prog)s [OPTIONS] --files-from FILE [SOURCE DEST]'
+    parser = argparse.ArgumentParser(usage=usage, description='Copy SOURCE to DEST, or multiple SOURCE(s) to DIRECTORY')
+    parser.add_argument('-a', action='store_true', dest='preserve_and_recurse', default=False, help='same as -dpRD')
+    parser.add_argument('-r', '-R', action='store_true', dest='recurse', default=False, help='recurse into directories')
+    
+    # symlink related:
+    parser.add_argument('-d', '-P', action='store_const', dest='links', const=L_PRESERVE, default=None, help='preserve (sym)links')
+    parser.add_argument('-L', action='store_const', dest='links', const=L_FOLLOW_ALL, help='follow all symlinks')
+    parser.add_argument('-H', action='store_const', dest='links', const=L_FOLLOW_TOP, help='follow symlinks on command line')
+    
+    # special files
+    parser.add_argument('-D', '--devices', action='store_true', dest='devices', default=False, help='recreate device files instead of copying their contents (implied by -a)')
+    parser.add_argument('--direct', action='store_true', dest='direct', default=False, help='read block devices with O_DIRECT when copying their contents')
+    
+    parser.add_argument('-p', action='store_true', dest='preserve_attributes', help='preserve file attributes if possible')
+    parser.add_argument('-f', action='store_true', dest='force', default=False, help='force overwriting existing destination files')
+    parser.add_argument('-e', '--exclude', action='append', dest='excludes', metavar='PATTERN', default=[], help='exclude file pattern')
+    parser.add_argument('--link-dest', action='append', dest='link_dest', metavar='DIR', default=[], help='hardlink files from DIR (relative to the current directory) instead of copying them, if size, mtime and mode are unchanged; may be given multiple times')
+    parser.add_argument('--move', action='store_true', dest='move', default=False, help='move instead of copy: rename within a filesystem, otherwise copy and remove the sources (implies -a)')
+    parser.add_argument('-i', '--interactive', action='store_true', dest='interactive', help='prompt before overwriting existing files')
+    # parser.add_argument('-l', '-s', action='store_true', dest='create_symlinks_only', default=False, help='Create (sym)links instead of copying.')
+    parser.add_argument('paths', metavar='PATH', nargs='*', help='SOURCE(s) and DEST')
+    
+    # version info
+    parser.add_argument('--version', '-V', action='version', version="%s %s" % (PROG, VERSION) )
+    
+    # verbose output
+    parser.add_argument('--verbose', '-v', action="count", default=0, help='be more verbose, -vv gives detailed progress information')
+    
+    # advanced options
+    parser.add_argument('-c', action='store_true', dest='resume', help='continue already existing partly copied files')
+    # parser.add_argument('--dry-run', action='store_true', dest="dry_run", default=False, help='Does a dry-run telling the user what would happen.')
+    
+    parser.add_argument('--order', dest='order', choices=sorted(ORDERS), default='none', help='order of the files within a directory: inode or physical reduce seeking on rotational disks, size copies large files first')
+    
+    # stat based filters
+    parser.add_argument('--min-size', dest='min_size', metavar='SIZE', type=parse_filesize, default=None, help='skip files smaller than SIZE')
+    parser.add_argument('--max-size', dest='max_size', metavar='SIZE', type=parse_filesize, default=None, help='skip files larger than SIZE')
+    parser.add_argument('--newer-than', dest='newer_than', metavar='TIME', type=parse_time, default=None, help="skip files not modified after TIME ('YYYY-MM-DD[ HH:MM[:SS]]', '@SECONDS' or the mtime of an existing file)")
+    parser.add_argument('--older-than', dest='older_than', metavar='TIME', type=parse_time, default=None, help='skip files not modified before TIME')
+    parser.add_argument('--user', dest='uid', metavar='USER', type=parse_user, default=None, help='skip files not owned by USER')
+    parser.add_argument('--group', dest='gid', metavar='GROUP', type=parse_group, default=None, help='skip files not owned by GROUP')
+    parser.add_argument('--type', dest='types', metavar='TYPES', type=parse_types, default=None, help='only copy these file types: f(ile), l(ink), b(lock), c(har), p(ipe), s(ocket); directories are always walked')
+    
+    # throttling
+    parser.add_argument('--bwlimit', dest='bwlimit', metavar='RATE', type=parse_filesize, default=0, help='limit the bandwidth to RATE bytes per second (suffixes K, M, G allowed)')
+    parser.add_argument('--iops-limit', dest='iops_limit', metavar='N', type=parse_count, default=0, help='limit the number of files, directories and links to N per second')
+    parser.add_argument('--limit-file', dest='limit_file', metavar='FILE', default=None, help="read 'bwlimit=RATE' and 'iops-limit=N' lines from FILE at start and on SIGUSR1")
+    
+    # tuning
+    parser.add_argument('--profile', dest='profile', metavar='PROFILE', default=None, help='use this copy engine/block size profile (compat, hdd, memory, network, reflink or ssd) instead of choosing one per filesystem')
+    parser.add_argument('--explain', action='store_true', dest='explain', default=False, help='print the profile chosen for each pair of filesystems')
+    parser.add_argument('--scan-threads', dest='scan_threads', metavar='N', type=int, default=None, help='list and stat directories with N threads ahead of the copy (default: taken from the profile, 0 walks sequentially)')
+    
+    # mirror mode
+    parser.add_argument('--watch', action='store_true', dest='watch', default=False, help='keep copying changes of the sources after the copy has finished (until interrupted)')
+    
+    # batch mode
+    parser.add_argument('--files-from', dest='files_from', metavar='FILE', default=None, help="read SOURCE DEST pairs from FILE ('-' for stdin); with 'SOURCE DEST' on the command line, read names relative to SOURCE instead")
+    parser.add_argument('--from0', action='store_true', dest='from0', default=False, help='entries of --files-from are separated by NUL instead of newline')
+    
+    # daemon mode
+    parser.add_argument('--daemon', dest='daemon', metavar='SOCKET', default=None, help='run the copies of clients connecting to SOCKET (see COPY_DAEMON in README.txt) until terminated')
+    
+    options = parser.parse_args(argv)
+    
+    if options.daemon is not None:
+        if options.paths:
+            parser.error("--daemon doesn't take any paths")
+        
+        from .daemon import serve
+        serve(options.daemon)
+        return 0
+    
+    # split paths into sources and target
+    if options.watch and (options.files_from is not None or options.move or options.interactive):
+        parser.error("--watch can't be used with --files-from, --move or -i")
+    
+    if options.files_from is not None:
+        if len(options.paths) not in (0, 2):
+            parser.error("--files-from expects either no paths or 'SOURCE DEST'")
+        
+        # the files in --link-dest are looked up relative to DEST
+        if options.link_dest and not options.paths:
+            parser.error("--link-dest with --files-from needs 'SOURCE DEST'")
+    elif len(options.paths) < 2:
+        parser.error("expected at least one SOURCE and DEST")
+    
+    options.sources = options.paths[:-1]
+    options.target = options.paths[-1] if options.paths else None
+    
+    # handle -a
+    if options.preserve_and_recurse or options.move:
+        options.recurse = True
+        options.preserve_attributes = True
+        options.devices = True
+    
+    options.order = ORDERS[options.order]
+    
+    # checked here, so that libcopy.tuning is only imported for a copy
+    if options.profile is not None:
+        from .tuning import PROFILES
+        if options.profile not in PROFILES:
+            parser.error("argument --profile: invalid choice: '%s' (choose from %s)" %
+                (options.profile, ', '.join(sorted(PROFILES))) )
+    
+    # set symlink policy
+    if options.move:
+        options.links = L_PRESERVE
+    elif options.links == None and options.recurse:
+        options.links = L_PRESERVE
+    elif options.links == None:
+        options.links = L_FOLLOW_TOP
+
+    # not needed for --help, --version or invalid arguments
+    from .manager import CopyManager
+    from .walker import FilesizeWalker, CopyWalker
+    
+    # prepare the manager
+    m = CopyManager(options)
+    
+    # stdin can't be read twice, so there's no total with --files-from -
+    if options.verbose >= 2 and options.files_from != '-':
+        m.workers.append( FilesizeWalker(m) )
+    
+    walker = CopyWalker(m)
+    m.workers.append(walker)
+    
+    if options.watch:
+        from .watch import Watcher
+        m.workers.append( Watcher(m, walker) )
+
+    # start the manager and check for errors
+    m.start()
+    if m.logger.had_errors:
+        return 1
+    else:
+        return 0
+
+def run(argv=None):
+    """Like main(), but reports uncaught exceptions instead of raising them."""
+    
+    try:
+        return main(argv)
+    except SystemExit as e:
+        # raised by argparse for --help, --version and invalid arguments
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write("%s\n" % e.code)
+        return 1
+    except KeyboardInterrupt:
+        sys.stderr.write('\n')
+        return 0
+    except Exception as e:
+        sys.stderr.write("Uncaught exception:\n%s\n" % str(e) )
+        sys.stderr.write("THIS IS A PROGRAMMING ERROR. PLEASE REPORT!\n")
+        return 2
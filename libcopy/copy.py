@@ -20,13 +20,21 @@
 __docformat__ = 'restructuredtext'
 
 # standard imports
+import errno
+import mmap
 import os
 
-from os.path import exists, getsize, isdir, islink, isfile
+from os.path import exists, getsize, isdir, islink, isfile, lexists
 from shutil import _samefile, Error, SpecialFileError, stat
 
 # local imports
 from .helpers import dummy
+from .linux import blkgetsize64, reflink
+
+# COPY ENGINES
+ENGINE_READ         = 'read'            # read() and write() blocks
+ENGINE_COPY_RANGE   = 'copy_file_range' # let the kernel copy the blocks
+ENGINE_REFLINK      = 'reflink'         # share the blocks (copy-on-write)
 
 def isdevfile(filename):
     """Test, if filename points to a device file.
@@ -91,7 +99,7 @@ def copylink(src, dst, force=False, hardlink=False):
         target = os.readlink(src)   
         os.symlink(target, dst)
 
-def copyfileobj(fsrc, fdst, length=16*1024, callback=dummy):
+def copyfileobj(fsrc, fdst, length=16*1024, callback=dummy, throttle=dummy):
     """Copy data from fsrc to fdst.
     
     :Parameters:
@@ -101,6 +109,9 @@ def copyfileobj(fsrc, fdst, length=16*1024, callback=dummy):
             The destination file of the data.
         `length` : int
             The blocksize to copy.
+        `throttle` : callable
+            Called with the size of every block before it is written.
+            It may sleep in order to limit the bandwidth.
     
     This function is called by the copyfile function.
     """
@@ -110,10 +121,129 @@ def copyfileobj(fsrc, fdst, length=16*1024, callback=dummy):
         if not buf:
             break
            
+        throttle( len(buf) )
         callback( len(buf) )
         fdst.write(buf)
 
-def copyfile(src, dst, length=16*1024, resume=False, force=False, callback=dummy):
+def copystat_fd(fsrc, fdst, st=None, dst=None):
+    """Copy owner, permission bits, extended attributes and times.
+    
+    :Parameters:
+        `fsrc` : int
+            File descriptor of the source file (or directory).
+        `fdst` : int
+            File descriptor of the destination file (or directory).
+        `st` : stat result
+            The stat result to copy from instead of fstat(fsrc).
+        `dst` : str
+            The name of the destination. It's used to set the times,
+            if os.utime() doesn't take file descriptors (Python 2).
+    
+    The owner is only copied, if we're allowed to (i.e. as root).
+    Extended attributes are skipped, if they aren't supported.
+    """
+    
+    if st is None:
+        st = os.fstat(fsrc)
+    
+    # chown() clears the setuid and setgid bits - so it comes first
+    try:
+        os.fchown(fdst, st.st_uid, st.st_gid)
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.EINVAL):
+            raise
+    
+    os.fchmod(fdst, stat.S_IMODE(st.st_mode))
+    
+    if hasattr(os, 'listxattr'):
+        try:
+            for name in os.listxattr(fsrc):
+                try:
+                    os.setxattr(fdst, name, os.getxattr(fsrc, name))
+                except OSError as e:
+                    if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.ENODATA):
+                        raise
+        except OSError as e:
+            if e.errno not in (errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+                raise
+    
+    # last - everything above may change the times
+    if hasattr(os, 'supports_fd') and os.utime in os.supports_fd:
+        os.utime(fdst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    elif dst is not None:
+        os.utime(dst, (st.st_atime, st.st_mtime))
+
+def copystat_dir(src, dst, st=None):
+    """Copy the metadata of the directory src to dst - see copystat_fd()."""
+    
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        fdst = os.open(dst, os.O_RDONLY)
+        try:
+            copystat_fd(fsrc, fdst, st=st, dst=dst)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+def copyrange(fsrc, fdst, length=1024**2, callback=dummy, throttle=dummy):
+    """Copy data from fsrc to fdst using copy_file_range().
+    
+    :Parameters:
+        `fsrc` : file-like object
+            The source file of the data.
+        `fdst` : file-like object
+            The destination file of the data.
+        `length` : int
+            The maximum number of bytes to copy per system call.
+    
+    Returns False, if the kernel can't copy between the files. The
+    file offsets are left where copying stopped, so copyfileobj() can
+    continue from there.
+    
+    :rtype: bool
+    """
+    
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    
+    copied = 0
+    while 1:
+        try:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), length)
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                            errno.EOPNOTSUPP, errno.EBADF):
+                return False
+            raise
+        
+        if not n:
+            # some pseudo filesystems claim to be empty
+            return copied > 0
+        
+        copied += n
+        throttle(n)
+        callback(n)
+
+def _copydata(fsrc, fdst, engine, length, callback, throttle):
+    if engine == ENGINE_REFLINK:
+        try:
+            reflink(fsrc.fileno(), fdst.fileno())
+        except EnvironmentError:
+            engine = ENGINE_COPY_RANGE
+        else:
+            callback( os.fstat(fsrc.fileno()).st_size )
+            return
+    
+    if engine == ENGINE_COPY_RANGE:
+        if copyrange(fsrc, fdst, length=length, callback=callback,
+                        throttle=throttle):
+            return
+    
+    copyfileobj(fsrc, fdst, length=length, callback=callback,
+        throttle=throttle)
+
+def copyfile(src, dst, length=16*1024, resume=False, force=False, callback=dummy, throttle=dummy, engine=ENGINE_READ, preserve=False):
     """Copy data from src to dst.
     
     :Parameters:
@@ -133,6 +263,16 @@ def copyfile(src, dst, length=16*1024, resume=False, force=False, callback=dummy
             A callback-function that is called everytime we copy a
             block of data. It should take exactly one argument: The
             number of bytes copied at that time.
+        `throttle` : callable
+            See copyfileobj().
+        `engine` : str
+            ENGINE_READ, ENGINE_COPY_RANGE or ENGINE_REFLINK. If the
+            engine is not supported for src and dst, the next one
+            in this order is used. Resumed copies always use
+            ENGINE_READ.
+        `preserve` : bool
+            Copy the metadata of src (see copystat_fd()) through the
+            open files, after the data has been written.
     """
 
     if _samefile(src, dst):
@@ -157,26 +297,187 @@ def copyfile(src, dst, length=16*1024, resume=False, force=False, callback=dummy
         dst_mode = 'wb'
 
     try:
-        with open(src, 'rb') as fsrc:
-            try:
-                with open(dst, dst_mode) as fdst:
-                    if offset > 0:
-                        fsrc.seek(offset)
-                        callback(offset)
-            
-                    copyfileobj(fsrc, fdst, length=length, callback=callback)
-            except IOError as e:
-                if force:
-                    try:
-                        os.unlink(dst)
-                    except OSError:
-                        raise Error("Can't remove '%s': Permission denied" % dst)
-                    copyfile(src, dst, length=length, resume=resume, force=False, callback=callback)
-                else:
-                    raise Error("Can't create '%s': Permission denied" % dst)
-                    
+        fsrc = open(src, 'rb')
     except IOError:
         raise Error("Can't open '%s': Permission denied" % src)
+    
+    with fsrc:
+        try:
+            fdst = open(dst, dst_mode)
+            try:
+                if offset > 0:
+                    fsrc.seek(offset)
+                    callback(offset)
+                    engine = ENGINE_READ
+                
+                _copydata(fsrc, fdst, engine, length, callback, throttle)
+                fdst.flush()
+            except:
+                fdst.close()
+                raise
+        except IOError as e:
+            if force:
+                try:
+                    os.unlink(dst)
+                except OSError:
+                    raise Error("Can't remove '%s': Permission denied" % dst)
+                copyfile(src, dst, length=length, resume=resume, force=False, callback=callback, throttle=throttle, engine=engine, preserve=preserve)
+                return
+            else:
+                raise Error("Can't create '%s': Permission denied" % dst)
+        
+        # the data is complete - errors from here on aren't about it
+        with fdst:
+            if preserve:
+                try:
+                    copystat_fd(fsrc.fileno(), fdst.fileno(), dst=dst)
+                except EnvironmentError as e:
+                    raise Error("Can't preserve the attributes of '%s': %s" % (dst, e.strerror))
+
+def _readinto(fd, buf):
+    if hasattr(os, 'readv'):
+        return os.readv(fd, [buf])
+    
+    data = os.read(fd, len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+def copydevice(src, dst, length=1024**2, direct=False, resume=False, force=False, callback=dummy, throttle=dummy):
+    """Copy the contents of the block device src to the image file dst.
+    
+    :Parameters:
+        `src` : str
+            The filename of the block device.
+        `dst` : str
+            The filename of the image (or another block device).
+        `length` : int
+            The blocksize to copy (defaults to 1M). It should be a
+            multiple of the device's sector size.
+        `direct` : bool
+            Read with O_DIRECT, bypassing the page cache.
+        `resume` : bool
+            Continue an interrupted copy at the last complete block
+            of dst, if dst is the beginning of src (see ispartfile()).
+        `force` : bool
+            Remove dst and try again, if it can't be opened.
+        `callback`, `throttle` : callable
+            See copyfile().
+    
+    Blocks of zeros are skipped if dst is a regular file, so the image
+    is sparse.
+    
+    :raise shutil.Error: Raised, if copying fails.
+    """
+    
+    if _samefile(src, dst):
+        raise Error("'%s' and '%s' are the same file" % (src, dst))
+    
+    flags = os.O_RDONLY
+    if direct and hasattr(os, 'O_DIRECT') and hasattr(os, 'readv'):
+        flags |= os.O_DIRECT
+    
+    try:
+        fsrc = os.open(src, flags)
+    except OSError as e:
+        raise Error("Can't open '%s': %s" % (src, e.strerror))
+    
+    try:
+        try:
+            size = blkgetsize64(fsrc)
+        except EnvironmentError:
+            size = os.lseek(fsrc, 0, os.SEEK_END)
+            os.lseek(fsrc, 0, os.SEEK_SET)
+        
+        if resume and exists(dst) and ispartfile(src, dst, srcsize=size):
+            offset = getsize(dst) - getsize(dst) % length
+            dst_flags = os.O_WRONLY
+        else:
+            offset = 0
+            dst_flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        
+        try:
+            fdst = os.open(dst, dst_flags, 0o666)
+        except OSError as e:
+            if not force or not lexists(dst):
+                raise Error("Can't create '%s': %s" % (dst, e.strerror))
+            
+            try:
+                os.unlink(dst)
+                offset = 0
+                fdst = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            except OSError as e:
+                raise Error("Can't create '%s': %s" % (dst, e.strerror))
+        
+        try:
+            sparse = stat.S_ISREG( os.fstat(fdst).st_mode )
+            
+            # O_DIRECT needs an aligned buffer - mmap()ed memory is
+            buf = mmap.mmap(-1, length)
+            zeros = b'\0' * length
+            
+            if offset > 0:
+                os.lseek(fsrc, offset, os.SEEK_SET)
+                callback(offset)
+            
+            while offset < size:
+                n = _readinto(fsrc, buf)
+                if not n:
+                    break
+                
+                throttle(n)
+                callback(n)
+                
+                if not (sparse and buf[:n] == zeros[:n]):
+                    os.lseek(fdst, offset, os.SEEK_SET)
+                    os.write(fdst, buf[:n])
+                
+                offset += n
+            
+            if sparse:
+                os.ftruncate(fdst, offset)
+        
+        except OSError as e:
+            raise Error("Can't copy '%s' to '%s': %s" % (src, dst, e.strerror))
+        
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+def copynode(src, dst, force=False):
+    """Create dst as the same kind of special file as src.
+    
+    Device files, named pipes and sockets are recreated with mknod()
+    instead of copying their contents.
+    
+    :Parameters:
+        `src` : str
+            The filename of the special file.
+        `dst` : str
+            The filename of the new special file.
+        `force` : bool
+            Force overwriting dst, if it exists.
+    
+    :raise shutil.Error: Raised, if creating dst fails.
+    """
+    
+    st = os.lstat(src)
+    
+    if lexists(dst):
+        if isdir(dst) and not islink(dst):
+            raise Error("cannot overwrite directory '%s' with non-directory" % dst)
+        elif not force:
+            raise Error("cannot create special file '%s': File exists" % dst)
+        
+        try:
+            os.unlink(dst)
+        except OSError:
+            raise Error("Can't remove '%s': Permission denied" % dst)
+    
+    try:
+        os.mknod(dst, st.st_mode, st.st_rdev)
+    except OSError as e:
+        raise Error("cannot create special file '%s': %s" % (dst, e.strerror))
 
 def _checkpart(fsrc, fdst, offset, length=512):
     fsrc.seek(offset)
@@ -190,7 +491,7 @@ def _checkpart(fsrc, fdst, offset, length=512):
     else:
         return False
 
-def ispartfile(src, dst, length=512, step=1024**2):
+def ispartfile(src, dst, length=512, step=1024**2, srcsize=None):
     """Checks whether dst is the beginning of the file src.
 
     :Parameters:
@@ -203,6 +504,9 @@ def ispartfile(src, dst, length=512, step=1024**2):
             in dst is the same as in src.
         `step` : int
             The distance between checked data blocks.
+        `srcsize` : int
+            The size of src, if getsize() doesn't know it (e.g. for
+            block devices).
 
     :rtype: bool
     
@@ -211,7 +515,8 @@ def ispartfile(src, dst, length=512, step=1024**2):
     every 1M as well as the last 512 bytes are equal.
     """
     
-    srcsize = getsize(src)
+    if srcsize is None:
+        srcsize = getsize(src)
     dstsize = getsize(dst)
     
     if srcsize < dstsize:
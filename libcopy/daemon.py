@@ -0,0 +1,445 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run copies in a long running process to save the startup time.
+
+A daemon started with 'copy --daemon SOCKET' runs the copy of each
+client in a process forked for it. Clients connect to the unix socket
+given by the COPY_DAEMON environment variable, send their arguments,
+working directory and umask and receive the output and the exit code.
+
+Everything is sent in frames: a tag, the length of the data and the
+data itself. The client sends nothing after its request - if it
+closes the connection (e.g. on Ctrl-C), its copy is aborted.
+
+Only the user running the daemon may connect to it.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports - keep these few, the client has to start fast
+import os
+import socket
+import struct
+import sys
+
+# frame tags
+_REQUEST    = b'r'      # NUL separated working directory, umask and argv
+_STDOUT     = b'1'
+_STDERR     = b'2'
+_EXIT       = b'x'      # exit code
+
+_HEADER = '!cI'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+# options needing the terminal, the stdin or the signals (SIGUSR1 for
+# --limit-file) of the client or running forever - these always run in
+# the client
+_LOCAL_OPTIONS = ('interactive', 'watch', 'daemon', 'limit-file')
+
+# seconds to wait for the request of a client
+_REQUEST_TIMEOUT = 5
+
+# the _Watch of the running copy (in a forked process)
+_watch = None
+
+# pids of the forked processes still running (in the daemon)
+_children = set()
+
+class _Terminated(BaseException):
+    """Raised by the signal handlers of the daemon.
+    
+    Unlike SystemExit or KeyboardInterrupt, it isn't caught by
+    libcopy.cli.run().
+    """
+    pass
+
+class _Aborted(BaseException):
+    """Raised, if the client of the running copy went away."""
+    pass
+
+def _terminate(signum, frame):
+    raise _Terminated()
+
+def _reap(signum, frame):
+    while 1:
+        try:
+            pid = os.waitpid(-1, os.WNOHANG)[0]
+        except OSError:
+            # no children left
+            return
+        
+        if not pid:
+            return
+        _children.discard(pid)
+
+def _interrupt(signum, frame):
+    # SIGINT is also how a _Watch interrupts the copy of a client
+    # that went away
+    if _watch is not None and _watch.gone:
+        _watch.gone = False
+        if _watch.running:
+            raise _Aborted()
+        return
+    
+    raise _Terminated()
+
+def _encode(s):
+    if sys.version_info.major >= 3:
+        return os.fsencode(s)
+    return s
+
+def _decode(s):
+    if sys.version_info.major >= 3:
+        return os.fsdecode(s)
+    return s
+
+def _send(sock, tag, data):
+    sock.sendall( struct.pack(_HEADER, tag, len(data)) + data )
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    
+    return data
+
+def _recv(sock):
+    """Return the (tag, data) of the next frame."""
+    tag, size = struct.unpack(_HEADER, _recv_exactly(sock, _HEADER_SIZE))
+    return tag, _recv_exactly(sock, size)
+
+class _Stream(object):
+    """File-like object sending everything written to it as frames."""
+    
+    encoding = 'utf-8'
+    
+    def __init__(self, sock, tag):
+        self.sock = sock
+        self.tag = tag
+    
+    def write(self, s):
+        if not isinstance(s, bytes):
+            s = _encode(s)
+        if s:
+            try:
+                _send(self.sock, self.tag, s)
+            except socket.error:
+                raise _Aborted()
+    
+    def flush(self):
+        pass
+    
+    def isatty(self):
+        return False
+
+class _Watch(object):
+    """Aborts the running copy, if its client goes away.
+    
+    As the client doesn't send anything after its request, reading from
+    the connection returns only when it is closed. The copy is then
+    interrupted with a SIGINT for the main thread (see _interrupt()).
+    """
+    
+    def __init__(self, conn):
+        import threading
+        
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.running = True
+        self.gone = False
+        
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        with self.lock:
+            self.running = False
+        
+        # wakes up recv()
+        try:
+            self.conn.shutdown(socket.SHUT_RD)
+        except socket.error:
+            pass
+        self.thread.join()
+    
+    def _watch(self):
+        try:
+            import _thread
+        except ImportError:
+            import thread as _thread
+        
+        try:
+            self.conn.recv(1)
+        except socket.error:
+            pass
+        
+        with self.lock:
+            if self.running:
+                self.gone = True
+                _thread.interrupt_main()
+
+def _peer_uid(conn):
+    """Return the uid of the client of conn or None, if it's unknown."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    
+    # struct ucred
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+def runs_locally(argv):
+    """Return whether the copy given by argv has to run in the client.
+    
+    :rtype: bool
+    """
+    
+    for i, arg in enumerate(argv):
+        if arg == '--':
+            break
+        
+        # long options may be abbreviated
+        if arg.startswith('--') and len(arg) > 2:
+            name, eq, value = arg[2:].partition('=')
+            
+            if any(option.startswith(name) for option in _LOCAL_OPTIONS):
+                return True
+            
+            if 'files-from'.startswith(name):
+                if not eq:
+                    value = argv[i + 1] if i + 1 < len(argv) else None
+                if value == '-':
+                    return True
+        
+        elif arg.startswith('-') and 'i' in arg[1:]:
+            return True
+    
+    return False
+
+def forward(path, argv):
+    """Run the copy given by argv in the daemon listening on path.
+    
+    Returns None, if the copy has to run in the client - because
+    there's no daemon or because of runs_locally().
+    
+    :Parameters:
+        `path` : str
+            The name of the unix socket of the daemon.
+        
+        `argv` : list
+            The command line arguments (without the program name).
+    
+    :rtype: int
+    """
+    
+    if runs_locally(argv):
+        return None
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    
+    umask = os.umask(0)
+    os.umask(umask)
+    
+    outputs = { _STDOUT : getattr(sys.stdout, 'buffer', sys.stdout),
+                _STDERR : getattr(sys.stderr, 'buffer', sys.stderr) }
+    
+    try:
+        request = [os.getcwd(), str(umask)] + list(argv)
+        _send(sock, _REQUEST, b'\0'.join(_encode(arg) for arg in request))
+        
+        while 1:
+            tag, data = _recv(sock)
+            if tag == _EXIT:
+                return int(data)
+            
+            output = outputs.get(tag)
+            if output:
+                output.write(data)
+                output.flush()
+    
+    except KeyboardInterrupt:
+        # closing the connection aborts the copy in the daemon
+        sys.stderr.write('\n')
+        return 0
+    
+    except (EOFError, socket.error) as e:
+        sys.stderr.write("copy: lost the connection to the daemon: %s\n" % e)
+        return 2
+    
+    finally:
+        sock.close()
+
+def serve(path):
+    """Run the copies of the clients connecting to path.
+    
+    Runs until it is terminated. The copy of each client runs in a
+    process forked for it, so that the modules are imported only once
+    and a long copy doesn't keep the other clients waiting. The copies
+    still running are terminated with the daemon.
+    
+    :Parameters:
+        `path` : str
+            The name of the unix socket to create.
+    """
+    
+    import errno
+    import signal
+    import stat
+    
+    from .cli import run
+    
+    # imported by every copy - import them once for all children
+    from . import manager, walker, tuning
+    
+    path = os.path.abspath(path)
+    
+    # remove a socket left by a daemon that was killed
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except OSError:
+        pass
+    
+    # Connecting needs write permission - whoever may connect copies
+    # with our privileges. The uid is checked below, too.
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    
+    # terminate through the finally clause below
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _interrupt)
+    signal.signal(signal.SIGCHLD, _reap)
+    
+    try:
+        while 1:
+            try:
+                conn = server.accept()[0]
+            except socket.error as e:
+                # python 2 doesn't retry after SIGCHLD
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            
+            try:
+                uid = _peer_uid(conn)
+                if uid is None or uid == os.getuid():
+                    _fork(server, conn, run)
+            except EnvironmentError:
+                # the client went away or we can't fork
+                pass
+            finally:
+                conn.close()
+    except _Terminated:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+        
+        for pid in list(_children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+def _fork(server, conn, run):
+    """Run the request of conn in a forked process."""
+    
+    import signal
+    
+    # a child exiting right away mustn't be reaped before it's added
+    block = hasattr(signal, 'pthread_sigmask')
+    if block:
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+    try:
+        pid = os.fork()
+        if pid == 0:
+            server.close()
+            _child(conn, run)
+        _children.add(pid)
+    finally:
+        if block:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+
+def _child(conn, run):
+    """Run the request of conn in a forked process and exit it."""
+    
+    import signal
+    
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    if hasattr(signal, 'pthread_sigmask'):
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+    
+    # os._exit() - the daemon cleans up after itself, not its children
+    code = 1
+    try:
+        _handle(conn, run)
+        code = 0
+    except (EOFError, EnvironmentError, _Aborted, _Terminated):
+        # the client went away or the daemon is terminated
+        pass
+    except BaseException:
+        import traceback
+        traceback.print_exc(file=sys.__stderr__)
+    finally:
+        os._exit(code)
+
+def _handle(conn, run):
+    """Run the request of one client - in a process of its own."""
+    
+    global _watch
+    
+    # don't let a client keep a process around by not sending its request
+    conn.settimeout(_REQUEST_TIMEOUT)
+    tag, data = _recv(conn)
+    conn.settimeout(None)
+    if tag != _REQUEST:
+        return
+    
+    request = [_decode(arg) for arg in data.split(b'\0')]
+    cwd, umask, argv = request[0], int(request[1]), request[2:]
+    
+    os.umask(umask)
+    sys.stdout = _Stream(conn, _STDOUT)
+    sys.stderr = _Stream(conn, _STDERR)
+    
+    _watch = _Watch(conn)
+    try:
+        os.chdir(cwd)
+    except OSError as e:
+        sys.stderr.write("copy: can't change to '%s': %s\n" % (cwd, e.strerror) )
+        code = 1
+    else:
+        code = run(argv)
+    finally:
+        _watch.stop()
+    
+    _send(conn, _EXIT, str(code).encode('ascii'))
@@ -0,0 +1,169 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Filters evaluated against the stat results of walk()."""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports
+import os
+import time
+
+# local imports
+from .walk import REG, LINK, BLOCK, CHAR, PIPE, SOCK
+
+# type letters as used by find -type
+TYPE_LETTERS = {    'f' : REG,
+                    'l' : LINK,
+                    'b' : BLOCK,
+                    'c' : CHAR,
+                    'p' : PIPE,
+                    's' : SOCK }
+
+_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+def parse_time(s):
+    """Return a timestamp from a string.
+
+    s is either the name of an existing file (its mtime is used), a
+    number of seconds since the epoch prefixed with '@' or a local
+    time given as 'YYYY-MM-DD[ HH:MM[:SS]]'.
+
+    :raise ValueError: Raised, if s is not a valid time.
+
+    :rtype: float
+    """
+    if os.path.exists(s):
+        return os.stat(s).st_mtime
+
+    if s.startswith('@'):
+        return float(s[1:])
+
+    for format in _TIME_FORMATS:
+        try:
+            return time.mktime( time.strptime(s, format) )
+        except ValueError:
+            continue
+
+    raise ValueError("invalid time '%s'" % s)
+
+def parse_types(s):
+    """Return the set of walk() types given by letters like 'fl'.
+
+    :raise ValueError: Raised, if s contains an unknown letter.
+
+    :rtype: set
+    """
+    types = set()
+    for letter in s.replace(',', ''):
+        if letter not in TYPE_LETTERS:
+            raise ValueError("invalid type '%s'" % letter)
+        types.add(TYPE_LETTERS[letter])
+
+    return types
+
+def parse_user(s):
+    """Return the uid of a user name or number.
+
+    :raise ValueError: Raised, if there's no such user.
+
+    :rtype: int
+    """
+    if s.isdigit():
+        return int(s)
+
+    import pwd
+    try:
+        return pwd.getpwnam(s).pw_uid
+    except KeyError:
+        raise ValueError("invalid user '%s'" % s)
+
+def parse_group(s):
+    """Return the gid of a group name or number.
+
+    :raise ValueError: Raised, if there's no such group.
+
+    :rtype: int
+    """
+    if s.isdigit():
+        return int(s)
+
+    import grp
+    try:
+        return grp.getgrnam(s).gr_gid
+    except KeyError:
+        raise ValueError("invalid group '%s'" % s)
+
+class StatFilter(object):
+    """Callable to be given to walk() as its filter keyword.
+
+    Every limit that is None is not checked. Sizes and times are not
+    checked for dangling symlinks.
+    """
+
+    def __init__(self, min_size=None, max_size=None, newer_than=None,
+                    older_than=None, uid=None, gid=None, types=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.newer_than = newer_than
+        self.older_than = older_than
+        self.uid = uid
+        self.gid = gid
+        self.types = types
+
+    @classmethod
+    def from_options(cls, options):
+        """Return a StatFilter for the options or None, if nothing is filtered."""
+        limits = dict(  min_size=options.min_size,
+                        max_size=options.max_size,
+                        newer_than=options.newer_than,
+                        older_than=options.older_than,
+                        uid=options.uid,
+                        gid=options.gid,
+                        types=options.types )
+
+        if all(limit is None for limit in limits.values()):
+            return None
+
+        return cls(**limits)
+
+    def __call__(self, st, type):
+        if self.types is not None and type not in self.types:
+            return False
+
+        if st is None:
+            return True
+
+        if self.min_size is not None and st.st_size < self.min_size:
+            return False
+
+        if self.max_size is not None and st.st_size > self.max_size:
+            return False
+
+        if self.newer_than is not None and st.st_mtime <= self.newer_than:
+            return False
+
+        if self.older_than is not None and st.st_mtime >= self.older_than:
+            return False
+
+        if self.uid is not None and st.st_uid != self.uid:
+            return False
+
+        if self.gid is not None and st.st_gid != self.gid:
+            return False
+
+        return True
@@ -41,6 +41,41 @@ def readable_filesize(filesize):
     return "%d" % filesize
 
 
+def parse_filesize(s):
+    """Return an integer filesize from a human readable string.
+    
+    This is the reverse of readable_filesize(). E.g.: "1.5K" -> 1536
+    
+    :Parameters:
+        `s` : str
+            The filesize, optionally followed by one of K, M, G or T.
+    
+    :raise ValueError: Raised, if s is not a valid filesize.
+    
+    :rtype: int
+    """
+    s = s.strip().upper()
+    
+    for size, ext in _FILESIZES:
+        if s.endswith(ext):
+            return _non_negative( int(float(s[:-1]) * size), s )
+    
+    return _non_negative( int(float(s)), s )
+
+def parse_count(s):
+    """Return a non-negative integer from a string.
+    
+    :raise ValueError: Raised, if s is not a valid count.
+    
+    :rtype: int
+    """
+    return _non_negative( int(s), s )
+
+def _non_negative(n, s):
+    if n < 0:
+        raise ValueError("negative value '%s'" % s)
+    return n
+
 def shortname(name, length=8):
     """Return a shorter name.
     
@@ -65,6 +100,40 @@ def shortname(name, length=8):
     
     return name[:part] + dots + name[-part:]
 
+def read_records(fobj, sep='\n', length=64*1024):
+    """Yield the records of a file-like object separated by sep.
+
+    The file is read in blocks, so only one block and the current
+    record are kept in memory. Empty records are skipped.
+
+    :Parameters:
+        `fobj` : file-like object
+            The file to read the records from.
+        `sep` : str or bytes
+            The record separator, e.g. '\\n' or '\\0'. It has to be
+            of the same type as the data read from fobj.
+        `length` : int
+            The blocksize to read.
+
+    :rtype: generator
+    """
+    rest = sep[:0]
+
+    while 1:
+        buf = fobj.read(length)
+        if not buf:
+            break
+
+        records = (rest + buf).split(sep)
+        rest = records.pop()
+
+        for record in records:
+            if record:
+                yield record
+
+    if rest:
+        yield rest
+
 def dummy(*args, **kwargs):
     """Do nothing - taking any arguments and keywords."""
     pass
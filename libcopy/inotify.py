@@ -0,0 +1,125 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Minimal ctypes binding of the Linux inotify API."""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+from collections import namedtuple
+
+# <sys/inotify.h>
+IN_ACCESS           = 0x00000001
+IN_MODIFY           = 0x00000002
+IN_ATTRIB           = 0x00000004
+IN_CLOSE_WRITE      = 0x00000008
+IN_MOVED_FROM       = 0x00000040
+IN_MOVED_TO         = 0x00000080
+IN_CREATE           = 0x00000100
+IN_DELETE           = 0x00000200
+IN_DELETE_SELF      = 0x00000400
+IN_MOVE_SELF        = 0x00000800
+
+IN_Q_OVERFLOW       = 0x00004000
+IN_IGNORED          = 0x00008000
+
+IN_DONT_FOLLOW      = 0x02000000
+IN_ISDIR            = 0x40000000
+
+IN_CLOEXEC          = 0o2000000
+
+_EVENT = 'iIII'     # wd, mask, cookie, len
+_EVENT_SIZE = struct.calcsize(_EVENT)
+
+Event = namedtuple('Event', 'wd mask cookie name')
+
+def _encode(path):
+    if sys.version_info.major >= 3:
+        return os.fsencode(path)
+    return path
+
+def _decode(name):
+    if sys.version_info.major >= 3:
+        return os.fsdecode(name)
+    return name
+
+class Inotify(object):
+    """An inotify instance.
+
+    :raise OSError: Raised, if inotify is not available.
+    """
+
+    def __init__(self):
+        libname = ctypes.util.find_library('c')
+        if libname is None:
+            raise OSError(errno.ENOSYS, "can't find the C library")
+
+        self.libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+
+        self.fd = self._check( self.libc.inotify_init1(IN_CLOEXEC) )
+
+    def _check(self, result, filename=None):
+        if result < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), filename)
+        return result
+
+    def add_watch(self, path, mask):
+        """Watch path for the events in mask and return the watch descriptor."""
+        return self._check(
+            self.libc.inotify_add_watch(self.fd, _encode(path), mask), path)
+
+    def rm_watch(self, wd):
+        self._check( self.libc.inotify_rm_watch(self.fd, wd) )
+
+    def read(self, timeout=None):
+        """Return a list of Events.
+
+        Waits at most timeout seconds (forever, if timeout is None) and
+        returns an empty list if there were no events.
+        """
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return []
+
+        buf = os.read(self.fd, 64*1024)
+        events = []
+        offset = 0
+
+        while offset < len(buf):
+            wd, mask, cookie, length = struct.unpack_from(_EVENT, buf, offset)
+            offset += _EVENT_SIZE
+
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            events.append( Event(wd, mask, cookie, _decode(name)) )
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
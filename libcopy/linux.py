@@ -0,0 +1,169 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Linux specific ioctls and system calls.
+
+All functions raise an IOError (or OSError) if the call is not
+supported by the platform, the filesystem or the file.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports
+import errno
+import os
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# <linux/fs.h>
+BLKGETSIZE64    = 0x80081272
+FICLONE         = 0x40049409
+
+# <linux/fiemap.h>
+FS_IOC_FIEMAP   = 0xC020660B
+_FIEMAP         = 'QQIIII'          # struct fiemap (without extents)
+_FIEMAP_EXTENT  = 'QQQQQIIII'       # struct fiemap_extent
+
+def _ioctl(fd, request, arg):
+    if fcntl is None:
+        raise IOError("ioctl() is not supported on this platform")
+
+    return fcntl.ioctl(fd, request, arg)
+
+def physical_offset(filename):
+    """Return the physical offset of the first extent of filename.
+
+    Uses the FIEMAP ioctl. Returns None for files without extents
+    (e.g. empty files).
+
+    :Parameters:
+        `filename` : str
+            The name of the file.
+
+    :rtype: int
+    """
+
+    request = struct.pack(_FIEMAP, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    request += b'\0' * struct.calcsize(_FIEMAP_EXTENT)
+
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        result = _ioctl(fd, FS_IOC_FIEMAP, request)
+    finally:
+        os.close(fd)
+
+    header_size = struct.calcsize(_FIEMAP)
+    mapped_extents = struct.unpack(_FIEMAP, result[:header_size])[3]
+    if mapped_extents == 0:
+        return None
+
+    extent = struct.unpack(_FIEMAP_EXTENT, result[header_size:])
+    return extent[1]    # fe_physical
+
+def blkgetsize64(fd):
+    """Return the size of the block device opened as fd in bytes.
+
+    :Parameters:
+        `fd` : int
+            A file descriptor of the block device.
+
+    :rtype: int
+    """
+
+    result = _ioctl(fd, BLKGETSIZE64, b'\0' * 8)
+    return struct.unpack('Q', result)[0]
+
+def devicesize(filename):
+    """Return the size of the block device filename in bytes.
+
+    :rtype: int
+    """
+
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        return blkgetsize64(fd)
+    finally:
+        os.close(fd)
+
+def reflink(src_fd, dst_fd):
+    """Let dst_fd share the data of src_fd (copy-on-write).
+
+    Uses the FICLONE ioctl, which is supported by btrfs and XFS (among
+    others) if both files are on the same filesystem.
+    """
+
+    _ioctl(dst_fd, FICLONE, src_fd)
+
+_libc = None
+
+def statfs_type(path):
+    """Return the magic number of the filesystem path is on.
+
+    See statfs(2) for the magic numbers.
+
+    :rtype: int
+    """
+
+    # ctypes takes longer to import than everything else we need
+    import ctypes
+
+    global _libc
+    if _libc is None:
+        # python itself is linked against the C library, so there's no
+        # need to search for it (ctypes.util.find_library() runs ldconfig)
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'statfs'):
+            raise OSError(errno.ENOSYS, "statfs() is not available")
+        _libc = libc
+
+    if sys.version_info.major >= 3:
+        path = os.fsencode(path)
+
+    # f_type is the first member of struct statfs
+    buf = ctypes.create_string_buffer(256)
+    if _libc.statfs(path, buf) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    return ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+
+def is_rotational(st_dev):
+    """Return whether the block device st_dev belongs to is rotational.
+
+    Returns None, if this can't be determined (e.g. for network or
+    memory filesystems).
+
+    :rtype: bool
+    """
+
+    sysdir = '/sys/dev/block/%d:%d' % (os.major(st_dev), os.minor(st_dev))
+
+    # partitions don't have a queue - their parent device has
+    for queue in (  os.path.join(sysdir, 'queue'),
+                    os.path.join(os.path.realpath(sysdir), '..', 'queue') ):
+        try:
+            with open(os.path.join(queue, 'rotational'), 'r') as f:
+                return f.read().strip() == '1'
+        except EnvironmentError:
+            continue
+
+    return None
@@ -19,6 +19,7 @@
 
 # standard imports
 import sys
+import time
 
 from os.path import basename, getsize
 
@@ -28,7 +29,9 @@ if sys.version_info.major >= 3:
 
 
 # local imports
+from .copy import isdevfile
 from .helpers import readable_filesize, shortname
+from .linux import devicesize
 
 
 PROG = basename(sys.argv[0])
@@ -46,7 +49,13 @@ class BaseLogger(object):
     
     def finish_copy(self, src, dst):
         pass
+    
+    def rename(self, src, dst):
+        pass
 
+    def info(self, msg):
+        sys.stderr.write("%s: %s\n" % (PROG, msg) )
+    
     def error(self, msg):
         self.had_errors = 1
         
@@ -59,6 +68,9 @@ class BaseLogger(object):
 
     def set_total(self, bytes_total):
         pass
+    
+    def watch_stats(self, backlog, latency):
+        pass
 
     
     def finish(self):
@@ -67,6 +79,12 @@ class BaseLogger(object):
 class VerboseLogger(BaseLogger):
     def start_copy(self, src, dst):
         sys.stderr.write("'%s' -> '%s'\n" % (src, dst) )
+    
+    def rename(self, src, dst):
+        sys.stderr.write("renamed '%s' -> '%s'\n" % (src, dst) )
+    
+    def watch_stats(self, backlog, latency):
+        sys.stderr.write("watch: %d change(s) replayed, latency %.2fs\n" % (backlog, latency) )
 
 class ProgressLogger(BaseLogger):
     def __init__(self, *args, **kwargs):
@@ -78,10 +96,25 @@ class ProgressLogger(BaseLogger):
         self.f_bytes_done = 0
         self.f_bytes_total = 0
         self.f_name = ""
+        
+        # the current rate is measured about every second
+        self.rate = 0
+        self.rate_bytes = 0
+        self.rate_time = time.time()
     
     def start_copy(self, src, dst):
+        # don't count the time before the first copy (e.g. for -vv's total)
+        if self.bytes_done == 0:
+            self.rate_time = time.time()
+        
         self.f_name = basename(src)
         self.f_bytes_total = getsize(src)
+        
+        if not self.f_bytes_total and isdevfile(src):
+            try:
+                self.f_bytes_total = devicesize(src)
+            except EnvironmentError:
+                pass
         self.f_bytes_done = 0
     
     def finish_copy(self, src, dst):
@@ -110,11 +143,29 @@ class ProgressLogger(BaseLogger):
             if i == 0:
                 s += ", total: "
                 i += 1
+        
+        now = time.time()
+        elapsed = now - self.rate_time
+        rate = self.rate
+        
+        if elapsed >= 1.0:
+            self.rate = rate = (self.bytes_done - self.rate_bytes) / elapsed
+            self.rate_bytes = self.bytes_done
+            self.rate_time = now
+        
+        elif not self.rate and elapsed > 0:
+            # less than a second has been measured so far
+            rate = (self.bytes_done - self.rate_bytes) / elapsed
+        
+        s += ", %s/s" % readable_filesize( int(rate) )
 
         fname = shortname(self.f_name + ': ', TERMINAL_WIDTH - len(s) )
         s = fname + s
         sys.stderr.write("\r%s" % s)
     
+    def watch_stats(self, backlog, latency):
+        sys.stderr.write("\nwatch: %d change(s) replayed, latency %.2fs\n" % (backlog, latency) )
+    
     def finish(self):
         sys.stderr.write('\n')
 
@@ -18,11 +18,24 @@
 """Very simple copymanager module."""
 
 # standard imports
+import os
+import signal
 import sys
 
+from os.path import join
+
 # local imports
+from .filters import StatFilter
+from .helpers import read_records
 from .logger import Logger
-from .walk import ModeError
+from .throttle import Throttle
+from .tuning import Tuner
+from .walk import ModeError, COPY_NEW_DIR, walk, walk_pairs
+
+def _fsdecode(name):
+    if hasattr(os, 'fsdecode'):
+        return os.fsdecode(name)
+    return name
 
 class CopyManager(object):
     """Takes care of letting the workers work (one after another)."""
@@ -32,6 +45,25 @@ class CopyManager(object):
         
         self.logger = Logger(verbose=self.options.verbose)
         self.workers = []
+        
+        self.throttle = Throttle(bwlimit=self.options.bwlimit,
+                            iops_limit=self.options.iops_limit,
+                            control_file=self.options.limit_file)
+        
+        self.filter = StatFilter.from_options(self.options)
+        
+        self.tuner = Tuner(self.logger, profile=self.options.profile,
+                            explain=self.options.explain)
+        
+        if self.options.limit_file:
+            self._reload_limits(None, None)
+            signal.signal(signal.SIGUSR1, self._reload_limits)
+    
+    def _reload_limits(self, signum, frame):
+        try:
+            self.throttle.reload()
+        except (ValueError, EnvironmentError) as e:
+            self.logger.error("can't reload limits: %s" % e)
     
     def start(self):
         # fatal exceptions should be caught here.
@@ -44,4 +76,88 @@ class CopyManager(object):
             self.logger.error( str(e) )
             return
         
+        except EnvironmentError as e:
+            # e.g. the file given by --files-from can't be read
+            self.logger.error("cannot read '%s': %s" % (e.filename, e.strerror) )
+            return
+        
         self.logger.finish()
+    
+    def walk(self, **kwargs):
+        """Returns a generator yielding the (TYPE, TOP, SRC, DST) jobs.
+        
+        The jobs are either read from the sources on the command line
+        or - in batch mode - from the file given by --files-from.
+        Additional keywords are passed to walk().
+        """
+        
+        kwargs.update( self.walk_options() )
+        
+        if self.options.files_from is None:
+            return walk(*self.options.sources,
+                        target=self.options.target, **kwargs)
+        
+        elif self.options.sources:
+            # entries are relative to the single source directory
+            base = self.options.sources[0]
+            pairs = ( (join(base, entry), join(self.options.target, entry))
+                        for entry in self._read_entries() )
+            return walk_pairs(pairs, mode=COPY_NEW_DIR, **kwargs)
+        
+        else:
+            return walk_pairs(self._read_pairs(), **kwargs)
+    
+    def walk_options(self):
+        """Returns the walk() keywords given by the options."""
+        return dict(recurse=self.options.recurse,
+                    excludes=self.options.excludes,
+                    filter=self.filter,
+                    order=self.options.order,
+                    links=self.options.links,
+                    threads=self.scan_threads())
+    
+    def scan_threads(self):
+        """Returns the number of threads to list directories with.
+        
+        Unless given by --scan-threads, it's taken from the profile for
+        the first source and the target.
+        """
+        
+        if self.options.scan_threads is not None:
+            return self.options.scan_threads
+        
+        # there's nothing to list ahead without -r
+        if not self.options.recurse or not self.options.sources:
+            return 0
+        
+        return self.tuner.select(self.options.sources[0],
+                                    self.options.target).scan_threads
+    
+    def _read_entries(self):
+        # Names are read as bytes and decoded like os.listdir() does, so
+        # that any name can be given - not only valid UTF-8.
+        if self.options.from0:
+            sep = b'\0'
+        else:
+            sep = b'\n'
+        
+        if self.options.files_from == '-':
+            stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+            for entry in read_records(stdin, sep=sep):
+                yield _fsdecode(entry)
+        else:
+            with open(self.options.files_from, 'rb') as f:
+                for entry in read_records(f, sep=sep):
+                    yield _fsdecode(entry)
+    
+    def _read_pairs(self):
+        entries = self._read_entries()
+        
+        for src in entries:
+            try:
+                dst = next(entries)
+            except StopIteration:
+                self.logger.error("missing destination for '%s'" % src)
+                return
+            
+            yield (src, dst)
@@ -0,0 +1,132 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Token bucket throttling of bytes and files per second."""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports
+import time
+
+# local imports
+from .helpers import parse_count, parse_filesize
+
+class TokenBucket(object):
+    """A token bucket allowing rate tokens per second.
+
+    A rate of 0 means unlimited. The bucket holds at most one second
+    worth of tokens, so bursts are bounded by the rate itself.
+    """
+
+    def __init__(self, rate=0, clock=time.time, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+
+        self.rate = 0
+        self.tokens = 0
+        self.last = clock()
+
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Change the rate - this may be done at any time."""
+        self.rate = rate
+        self.tokens = min(self.tokens, rate)
+
+    def consume(self, tokens=1):
+        """Take tokens from the bucket, sleeping until they are available.
+
+        Taking more tokens than the bucket holds is allowed. The
+        bucket goes into debt and the caller sleeps until it is paid
+        back.
+        """
+        if not self.rate:
+            return
+
+        now = self.clock()
+        self.tokens = min(self.rate,
+                        self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        self.tokens -= tokens
+        if self.tokens < 0:
+            self.sleep(-self.tokens / float(self.rate))
+
+
+class Throttle(object):
+    """Limits the bytes and files per second of a copy run.
+
+    The limits can be changed at runtime by rewriting the control file
+    and calling reload() - the copy tool does this on SIGUSR1. The
+    control file contains lines of 'bwlimit=RATE' and 'iops-limit=N',
+    where RATE may use the suffixes K, M, G and T. Unknown keys are
+    errors, missing keys keep their current value. A limit of 0 means
+    unlimited.
+    """
+
+    def __init__(self, bwlimit=0, iops_limit=0, control_file=None):
+        self.bytes = TokenBucket(bwlimit)
+        self.files = TokenBucket(iops_limit)
+
+        self.control_file = control_file
+
+    def consume_bytes(self, nbytes):
+        self.bytes.consume(nbytes)
+
+    def chunk_size(self, length, align=1):
+        """Return the block size to copy with instead of length.
+
+        With a bandwidth limit, blocks are at most one second worth of
+        bytes (rounded down to a multiple of align), so that the limit
+        isn't enforced by long sleeps after large bursts.
+        """
+        rate = self.bytes.rate
+        if not rate or rate >= length:
+            return length
+
+        return max(rate - rate % align, align)
+
+    def consume_files(self, nfiles=1):
+        self.files.consume(nfiles)
+
+    def reload(self):
+        """Re-read the limits from the control file.
+
+        :raise ValueError: Raised, if the control file is invalid.
+        :raise IOError: Raised, if the control file can't be read.
+        """
+        buckets = { 'bwlimit' : (self.bytes, parse_filesize),
+                    'iops-limit' : (self.files, parse_count) }
+        rates = []
+
+        with open(self.control_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                key, sep, value = line.partition('=')
+                if key.strip() not in buckets:
+                    raise ValueError("invalid line in '%s': %s" %
+                                        (self.control_file, line) )
+
+                bucket, convert = buckets[key.strip()]
+                rates.append( (bucket, convert(value)) )
+
+        # only apply the limits, if the whole file is valid
+        for bucket, rate in rates:
+            bucket.set_rate(rate)
@@ -0,0 +1,178 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Choose copy engine, block size and concurrency per filesystem pair."""
+
+__docformat__ = 'restructuredtext'
+
+# standard imports
+import os
+
+from collections import namedtuple
+from os.path import curdir, dirname
+
+# local imports
+from .copy import ENGINE_READ, ENGINE_COPY_RANGE, ENGINE_REFLINK
+from .helpers import readable_filesize
+from .linux import is_rotational, statfs_type
+
+# statfs(2) magic numbers of the filesystems we care about
+FS_TYPES = {    0xEF53      : 'ext4',
+                0x9123683E  : 'btrfs',
+                0x58465342  : 'xfs',
+                0x2FC12FC1  : 'zfs',
+                0x01021994  : 'tmpfs',
+                0x858458F6  : 'ramfs',
+                0x6969      : 'nfs',
+                0xFF534D42  : 'cifs',
+                0xFE534D42  : 'smb2',
+                0x65735546  : 'fuse',
+                0x794C7630  : 'overlayfs',
+            }
+
+REFLINK_FS = ('btrfs', 'xfs')
+NETWORK_FS = ('nfs', 'cifs', 'smb2', 'fuse')
+MEMORY_FS  = ('tmpfs', 'ramfs')
+
+# scan_threads list directories ahead of the copy (see walk())
+Profile = namedtuple('Profile', 'name engine length direct scan_threads')
+
+PROFILES = dict( (p.name, p) for p in [
+    #       name        engine              length      direct  scan_threads
+    Profile('compat',   ENGINE_READ,        16*1024,    False,  0),
+    Profile('ssd',      ENGINE_COPY_RANGE,  1024**2,    True,   4),
+    Profile('hdd',      ENGINE_COPY_RANGE,  4*1024**2,  True,   0),
+    Profile('reflink',  ENGINE_REFLINK,     1024**2,    True,   4),
+    Profile('network',  ENGINE_COPY_RANGE,  1024**2,    False,  16),
+    Profile('memory',   ENGINE_COPY_RANGE,  1024**2,    False,  0),
+    ])
+
+DEFAULT_PROFILE = 'ssd'
+
+# st_dev -> (fstype, rotational), shared by all Tuners of a process
+_devices = {}
+
+class Tuner(object):
+    """Picks a Profile for each pair of source and destination filesystems.
+
+    The filesystem type and whether the device is rotational are
+    detected once per device (st_dev) and process. If profile is given,
+    it is used for everything and nothing is detected. If explain is
+    True, the decisions are written to the logger.
+    """
+
+    def __init__(self, logger, profile=None, explain=False):
+        self.logger = logger
+        self.profile = profile
+        self.explain = explain
+
+        self.devices = _devices
+        self.profiles = {}      # (src st_dev, dst st_dev) -> Profile
+
+        self._last_dirs = None
+        self._last_profile = None
+
+    def select(self, src, dst):
+        """Returns the Profile to copy src to dst with."""
+
+        if self.profile:
+            return self._given()
+
+        dirs = (dirname(src) or curdir, dirname(dst) or curdir)
+        if dirs == self._last_dirs:
+            return self._last_profile
+
+        try:
+            key = (os.stat(dirs[0]).st_dev, os.stat(dirs[1]).st_dev)
+        except OSError:
+            return PROFILES[DEFAULT_PROFILE]
+
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = self._choose(dirs, key)
+            self.profiles[key] = profile
+
+        self._last_dirs = dirs
+        self._last_profile = profile
+        return profile
+
+    def device(self, path, st_dev):
+        """Returns (fstype, rotational) of the device st_dev of path."""
+
+        if st_dev not in self.devices:
+            try:
+                magic = statfs_type(path)
+                fstype = FS_TYPES.get(magic, hex(magic))
+            except EnvironmentError:
+                fstype = 'unknown'
+
+            self.devices[st_dev] = (fstype, is_rotational(st_dev))
+
+        return self.devices[st_dev]
+
+    def _choose(self, dirs, key):
+        src_fs, src_rot = self.device(dirs[0], key[0])
+        dst_fs, dst_rot = self.device(dirs[1], key[1])
+
+        if src_fs == dst_fs and src_fs in REFLINK_FS:
+            name, reason = 'reflink', 'both on %s' % src_fs
+        elif src_fs in NETWORK_FS or dst_fs in NETWORK_FS:
+            name, reason = 'network', 'network filesystem'
+        elif src_rot or dst_rot:
+            name, reason = 'hdd', 'rotational disk'
+        elif src_fs in MEMORY_FS or dst_fs in MEMORY_FS:
+            name, reason = 'memory', 'memory filesystem'
+        else:
+            name, reason = DEFAULT_PROFILE, 'default'
+
+        profile = PROFILES[name]
+
+        # tmpfs doesn't support O_DIRECT at all
+        if src_fs in MEMORY_FS or dst_fs in MEMORY_FS:
+            profile = profile._replace(direct=False)
+
+        if self.explain:
+            self.logger.info("'%s' (%s%s) -> '%s' (%s%s): %s" % (
+                dirs[0], src_fs, _rotational(src_rot),
+                dirs[1], dst_fs, _rotational(dst_rot),
+                _describe(profile, reason)) )
+
+        return profile
+
+    def _given(self):
+        # statfs() and sysfs aren't worth asking, if the answer is known
+        if self._last_profile is None:
+            self._last_profile = PROFILES[self.profile]
+            if self.explain:
+                self.logger.info("all files: %s" %
+                    _describe(self._last_profile, 'given by --profile') )
+
+        return self._last_profile
+
+def _describe(profile, reason):
+    return ("profile %s (%s): engine %s, block size %s, O_DIRECT %s, "
+        "%d scan thread(s)" % (profile.name, reason, profile.engine,
+        readable_filesize(profile.length),
+        profile.direct and 'allowed' or 'off', profile.scan_threads) )
+
+def _rotational(rotational):
+    if rotational is None:
+        return ''
+    elif rotational:
+        return ', rotational'
+    else:
+        return ', non-rotational'
@@ -21,14 +21,17 @@
 import os
 import stat
 
-from fnmatch import fnmatch
 from os.path import isdir, islink, join, normpath, relpath
 
+# local imports
+from .linux import physical_offset
+
 
 # file types
 NOSTAT      = -1    # does not exist
 IGNORE      = -2    # directory, we don't want to recurse into
 EXCLUDE     = -3    # pathname was explicitly excluded
+NOLIST      = -4    # directory, that can't be listed
         
 REG         = 1     # regular file
 DIR         = 2     # directory
@@ -39,11 +42,26 @@ CHAR        = 6     # character device
 PIPE        = 7     # pipe
 SOCK        = 8     # socket
         
+# file types by stat.S_IFMT()
+_TYPES = {  stat.S_IFREG    : REG,
+            stat.S_IFDIR    : DIR,
+            stat.S_IFLNK    : LINK,
+            stat.S_IFBLK    : BLOCK,
+            stat.S_IFCHR    : CHAR,
+            stat.S_IFIFO    : PIPE,
+            stat.S_IFSOCK   : SOCK }
+        
 # LINK POLICIES
 L_FOLLOW_TOP    = 1
 L_FOLLOW_ALL    = 2
 L_PRESERVE      = 3
 
+# ORDER POLICIES - order of the entries within a directory
+O_NONE          = 0 # as returned by os.listdir()
+O_INODE         = 1 # by inode number
+O_PHYSICAL      = 2 # by physical offset of the first extent
+O_SIZE          = 3 # largest files first
+
 # COPY MODES - represents one of the three cases possible:
 COPY_FILE       = 1 # copy file to file
 COPY_EX_DIR     = 2 # copy files and directories to an existing directory
@@ -62,6 +80,7 @@ def walk(*paths, **kwargs):
      - NOSTAT       File does not exist
      - IGNORE       Directory, we don't want to recurse into
      - EXCLUDE      Pathname has been excluded
+     - NOLIST       Directory can't be listed (yielded after its DIR)
      
      - REG          Regular file
      - DIR          Directory
@@ -69,6 +88,7 @@ def walk(*paths, **kwargs):
      - HARDLINK     Hardlink (regular file)
      - BLOCK        Block device
      - CHAR         Character device
+     - PIPE         Named pipe (FIFO)
      - SOCK         Socket
     
     TOP is one of the paths that was given to walk(). This is useful
@@ -102,6 +122,47 @@ def walk(*paths, **kwargs):
      
                     default = []
      
+     - order:       O_NONE          Order as returned by os.listdir()
+                    O_INODE         Order by inode number
+                    O_PHYSICAL      Order by physical offset of the
+                                    first extent (FIEMAP), falls
+                                    back to the inode number
+                    O_SIZE          Order largest files first
+                    
+                    The order applies to the entries of each
+                    directory. Directories are still walked before
+                    their contents.
+                    
+                    default = O_NONE
+     
+     - hardlinks:   True            Yield HARDLINK for files sharing
+                                    an inode (only with L_PRESERVE)
+                    False           Yield REG for every regular file
+                    
+                    default = True
+     
+     - prune:       Container of directory paths not to recurse into.
+                    It may be changed while walking, e.g. by adding a
+                    directory after its DIR result has been yielded.
+                    
+                    default = ()
+     
+     - filter:      Callable taking the stat result and the TYPE of a
+                    non-directory entry (stat result is None for
+                    dangling symlinks). Entries it returns False for
+                    are yielded as EXCLUDE. Symlinks that are followed
+                    are tested with the stat result of their target.
+                    
+                    default = None
+     
+     - threads:     Number of threads listing and stating directories
+                    ahead of the walk. This pays off on filesystems
+                    with a high latency per call (e.g. NFS). Results
+                    are still yielded in the same order as without
+                    threads. 0 or 1 walks sequentially.
+                    
+                    default = 0
+     
      - target:      Name of the target.
      
                     default = None (invalid)
@@ -110,30 +171,99 @@ def walk(*paths, **kwargs):
     
     inodes = {}
     
-    links = kwargs.pop('links', L_FOLLOW_TOP)
-    recurse = kwargs.pop('recurse', False)
-    excludes = kwargs.pop('excludes', [])
     target = kwargs.pop('target', None)
+    options = _pop_options('walk', kwargs)
     
     if target == None:
         raise TypeError("walk() expects keyword argument 'target'.")
     
-    for key in kwargs:
-        raise TypeError("walk() got an unexpected keyword argument '%s'" % key)
-
     # detect the copy mode
     mode = _detect_mode(*paths, target=target)
-        
-    for path in paths:
-        for result in _walk_path(path,
-                            top=path,
-                            target=target,
-                            recurse=recurse,
-                            links=links,
-                            excludes=excludes,
-                            inodes=inodes,
-                            mode=mode):
-            yield result
+    
+    lister = _start_lister(options)
+    try:
+        for path in paths:
+            for result in _walk_path(path,
+                                top=path,
+                                target=target,
+                                inodes=inodes,
+                                mode=mode,
+                                **options):
+                yield result
+    finally:
+        if lister:
+            lister.close()
+
+def walk_pairs(pairs, **kwargs):
+    """Walks along (SRC, DST) pairs yielding a 4-tuple (TYPE, TOP, SRC, DST).
+    
+    Every pair is walked as if walk(SRC, target=DST) was called on its
+    own, but all pairs share one hardlink table. pairs may be any
+    iterable (e.g. a generator reading from a file), it is consumed
+    lazily.
+    
+    Accepted keywords:
+     - links, recurse, excludes, order, hardlinks, prune, filter, threads:
+                    See walk().
+     
+     - mode:        COPY_FILE, COPY_EX_DIR or COPY_NEW_DIR to use for
+                    every pair.
+                    
+                    default = None (detect the mode for each pair)
+    
+    """
+    
+    inodes = {}
+    
+    mode = kwargs.pop('mode', None)
+    options = _pop_options('walk_pairs', kwargs)
+    
+    lister = _start_lister(options)
+    try:
+        for path, target in pairs:
+            for result in _walk_path(path,
+                                top=path,
+                                target=target,
+                                inodes=inodes,
+                                mode=mode or _detect_mode(path, target=target),
+                                **options):
+                yield result
+    finally:
+        if lister:
+            lister.close()
+
+def _pop_options(name, kwargs):
+    """Pops the keywords common to walk() and walk_pairs() from kwargs.
+    
+    Raises a TypeError for any other keyword left in kwargs.
+    """
+    
+    options = dict( links=kwargs.pop('links', L_FOLLOW_TOP),
+                    recurse=kwargs.pop('recurse', False),
+                    excludes=kwargs.pop('excludes', []),
+                    order=kwargs.pop('order', O_NONE),
+                    hardlinks=kwargs.pop('hardlinks', True),
+                    prune=kwargs.pop('prune', ()),
+                    filter=kwargs.pop('filter', None),
+                    lister=None )
+    
+    threads = kwargs.pop('threads', 0)
+    
+    for key in kwargs:
+        raise TypeError("%s() got an unexpected keyword argument '%s'" % (name, key))
+    
+    if threads > 1 and options['recurse']:
+        options['lister'] = _Lister(threads, options['links'],
+                                    options['excludes'], options['prune'])
+    
+    return options
+
+def _start_lister(options):
+    """Starts the threads of the _Lister in options and returns it (or None)."""
+    lister = options['lister']
+    if lister:
+        lister.start()
+    return lister
 
 def _detect_mode(*paths, **kwargs):
     """Detects the file/dir state for src paths and target and returns MODE.
@@ -178,19 +308,89 @@ def _compose_dst(top, src, target, mode=COPY_EX_DIR):
         return normpath( join(target, relpath(src, top) ) )
         
 def _is_excluded(path, excludes):
+    if not excludes:
+        return False
+    
+    from fnmatch import fnmatch
     for exclude in excludes:
         if fnmatch(path, exclude):
             return True
     
     return False
 
+def _order_key(path, order, st=None):
+    """Returns the key to sort path by for the given order."""
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (0, 0)
+    
+    if order == O_SIZE:
+        return (0, -st.st_size)
+    
+    elif order == O_PHYSICAL and stat.S_ISREG(st.st_mode):
+        try:
+            offset = physical_offset(path)
+        except EnvironmentError:
+            offset = None
+        
+        if offset is not None:
+            return (0, offset)
+    
+    # files without extents follow the others
+    return (1, st.st_ino)
+
+def _listdir(path, order=O_NONE, lister=None):
+    """Returns (NAME, PRE) for the entries of path in the given order.
+    
+    PRE is what the lister found for the entry, see _Lister.listdir(),
+    or None without a lister.
+    """
+    if lister:
+        entries = lister.listdir(path)
+        
+        # same keys as below
+        if order == O_INODE and hasattr(os, 'scandir'):
+            entries.sort(key=lambda entry: entry[3])
+        elif order != O_NONE:
+            keys = {}
+            for name, st, is_link, ino in entries:
+                if st is None:
+                    keys[name] = (0, 0)
+                else:
+                    keys[name] = _order_key(join(path, name), order, st)
+            entries.sort(key=lambda entry: keys[entry[0]])
+        
+        return [(name, (st, is_link)) for name, st, is_link, ino in entries]
+    
+    return [(name, None) for name in _listnames(path, order)]
+
+def _listnames(path, order):
+    """Returns the names of the entries in path in the given order."""
+    if order == O_NONE:
+        return os.listdir(path)
+    
+    # scandir() gives us the inode numbers without calling stat()
+    if order == O_INODE and hasattr(os, 'scandir'):
+        entries = sorted(os.scandir(path), key=lambda entry: entry.inode())
+        return [entry.name for entry in entries]
+    
+    keys = {}
+    for item in os.listdir(path):
+        keys[item] = _order_key(join(path, item), order)
+    
+    return sorted(keys, key=keys.get)
+
 def _walk_path( path, top=None, target=None, recurse=False,
-                links=L_FOLLOW_TOP, excludes=[], inodes={},
-                mode=COPY_EX_DIR):
+                links=L_FOLLOW_TOP, excludes=[], order=O_NONE,
+                hardlinks=True, prune=(), filter=None, inodes={},
+                mode=COPY_EX_DIR, lister=None, pre=None):
     """Walks along the given paths. Yields (TYPE, TOP, SRC, DST) tuple.
     
     This is an internal function and does the real work described by
-    walk().
+    walk(). pre is (STAT, IS_LINK) of path if the lister already
+    looked at it.
     """
     
     dst = _compose_dst(top, path, target, mode=mode)
@@ -199,35 +399,71 @@ def _walk_path( path, top=None, target=None, recurse=False,
         st = None
         yield (EXCLUDE, top, path, dst)
     else:
+        if pre:
+            st, is_link = pre
+        else:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            is_link = islink(path)
+        
         # handle non-existent files
-        try:
-            st = os.stat(path)
-        except OSError:
-            st = None
-            yield (NOSTAT, top, path, dst)
+        if st is None:
+            # dangling symlinks can still be copied as links
+            if is_link and (links == L_PRESERVE or
+                    (links == L_FOLLOW_TOP and path != top) ):
+                if filter and not filter(None, LINK):
+                    yield (EXCLUDE, top, path, dst)
+                else:
+                    yield (LINK, top, path, dst)
+            else:
+                yield (NOSTAT, top, path, dst)
         
     as_link = False
             
     # handle symlinks
-    if st and islink(path):
+    if st and is_link:
         if links == L_PRESERVE:
             as_link = True
-            yield (LINK, top, path, dst)
 
         elif links == L_FOLLOW_TOP and path != top:
             as_link = True
-            yield (LINK, top, path, dst)
-
+    
+    # stat based filters - directories are always walked
+    if st and filter and (as_link or not stat.S_ISDIR(st.st_mode)):
+        if as_link:
+            type = LINK
+        else:
+            type = _TYPES.get(stat.S_IFMT(st.st_mode))
         
-    if st and not as_link:
+        if not filter(st, type):
+            yield (EXCLUDE, top, path, dst)
+            return
+    
+    if as_link:
+        yield (LINK, top, path, dst)
+        
+    elif st:
         if stat.S_ISDIR(st.st_mode):
             if not recurse:
                 yield (IGNORE, top, path, dst)
             else:
                 yield (DIR, top, path, dst)
                 
+                if path in prune:
+                    if lister:
+                        lister.discard(path)
+                    return
+                
                 # recurse into dir
-                for item in os.listdir(path):
+                try:
+                    entries = _listdir(path, order, lister)
+                except OSError:
+                    yield (NOLIST, top, path, dst)
+                    return
+                
+                for item, item_pre in entries:
                     fullname = join(path, item)
                     for result in _walk_path(fullname,
                                         top=top,
@@ -235,24 +471,32 @@ def _walk_path( path, top=None, target=None, recurse=False,
                                         recurse=recurse,
                                         links=links,
                                         excludes=excludes,
+                                        order=order,
+                                        hardlinks=hardlinks,
+                                        prune=prune,
+                                        filter=filter,
                                         inodes=inodes,
-                                        mode=mode):
+                                        mode=mode,
+                                        lister=lister,
+                                        pre=item_pre):
                         yield result
             
         elif stat.S_ISREG(st.st_mode):
             # check for hardlinks
-            if links == L_PRESERVE:
-                old_path = inodes.get(st.st_ino, None)
+            if links == L_PRESERVE and hardlinks and st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                old_path = inodes.get(key, None)
                 if old_path:
                     yield (HARDLINK, top, old_path, dst)
                 else:
                     # track this file:
-                    inodes[st.st_ino] = dst
+                    inodes[key] = dst
                     yield (REG, top, path, dst)
                 
             else:
-                # no need to keep track of inodes if
-                # links is not L_PRESERVE
+                # no need to keep track of inodes if links is not
+                # L_PRESERVE, hardlinks aren't wanted or the file has
+                # only one link
                 yield (REG, top, path, dst)
             
         elif stat.S_ISBLK(st.st_mode):
@@ -261,6 +505,227 @@ def _walk_path( path, top=None, target=None, recurse=False,
         elif stat.S_ISCHR(st.st_mode):
             yield (CHAR, top, path, dst)
             
+        elif stat.S_ISFIFO(st.st_mode):
+            yield (PIPE, top, path, dst)
+            
         elif stat.S_ISSOCK(st.st_mode):
             yield (SOCK, top, path, dst)
             
+
+# states of the directories known to the _Lister
+_QUEUED     = 1     # waiting for a thread
+_RUNNING    = 2     # being listed by a thread
+_DONE       = 3     # listed, result waits for the walk
+_CLAIMED    = 4     # the walk got there first and lists it itself
+
+class _Lister(object):
+    """Lists and stats directories ahead of the walk with a pool of threads.
+    
+    Whenever a directory has been listed, its subdirectories are queued
+    for the threads - the first one on top, so that the threads roughly
+    follow the depth-first order of the walk. At most limit directories
+    are queued or listed but not yet picked up by the walk.
+    
+    Directories in prune (and everything below them) are not listed.
+    As prune may only change while walking, directories listed before
+    they were pruned are dropped by discard().
+    
+    The walk itself still visits the directories one after another, so
+    the order of the results (and thereby which of several hardlinks is
+    yielded as REG) doesn't depend on the threads. If the walk reaches a
+    directory the threads haven't started on, it lists it itself.
+    """
+    
+    def __init__(self, threads, links=L_FOLLOW_TOP, excludes=[], prune=(),
+                    limit=4096):
+        self.threads = threads
+        self.links = links
+        self.excludes = excludes
+        self.prune = prune
+        self.limit = limit
+        
+        # only imported if threads are wanted
+        import threading
+        
+        self.cond = threading.Condition()
+        self.stack = []         # queued paths, the next one last
+        self.states = {}        # path -> state
+        self.results = {}       # path -> entries or OSError
+        self.parents = {}       # path -> parent of the paths in states
+        self.closed = False
+    
+    def start(self):
+        import threading
+        
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+    
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.stack = []
+            self.states = {}
+            self.results = {}
+            self.parents = {}
+            self.cond.notify_all()
+    
+    def discard(self, path):
+        """Drops everything listed or queued below the pruned path."""
+        
+        with self.cond:
+            # find all of them first - forgetting one breaks the chain
+            # of parents of the others
+            below = [p for p in self.states if self._pruned(p)]
+            
+            for p in below:
+                if self.states[p] == _RUNNING:
+                    # dropped by the thread listing it
+                    self.parents[p] = path
+                else:
+                    self._forget(p)
+    
+    def _pruned(self, path):
+        # The walk never gets below a pruned directory, so it's enough
+        # to check the directories the walk hasn't picked up yet.
+        while path is not None:
+            if path in self.prune:
+                return True
+            path = self.parents.get(path)
+        
+        return False
+    
+    def _forget(self, path):
+        self.states.pop(path, None)
+        self.results.pop(path, None)
+        self.parents.pop(path, None)
+    
+    def listdir(self, path):
+        """Returns a list of (NAME, STAT, IS_LINK, INO) for the entries of path.
+        
+        STAT is the result of os.stat() or None, if that failed. INO is
+        the inode number of the entry itself (not of a symlink's target).
+        Raises an OSError like os.listdir().
+        """
+        
+        with self.cond:
+            state = self.states.get(path)
+            while state == _RUNNING:
+                self.cond.wait()
+                state = self.states.get(path)
+            
+            if state == _DONE:
+                result = self.results[path]
+                self._forget(path)
+            else:
+                if state == _QUEUED:
+                    self.states[path] = _CLAIMED
+                result = None
+        
+        if result is None:
+            result = self._list(path)
+            self._queue_subdirs(path, result)
+        
+        elif isinstance(result, OSError):
+            raise result
+        
+        return result
+    
+    def _work(self):
+        while 1:
+            with self.cond:
+                while not self.stack and not self.closed:
+                    self.cond.wait()
+                
+                if self.closed:
+                    return
+                
+                path = self.stack.pop()
+                if self.states.get(path) != _QUEUED or self._pruned(path):
+                    self._forget(path)
+                    continue
+                
+                self.states[path] = _RUNNING
+            
+            try:
+                result = self._list(path)
+            except OSError as e:
+                result = e
+            
+            with self.cond:
+                if self.closed:
+                    return
+                
+                if self._pruned(path):
+                    self._forget(path)
+                    self.cond.notify_all()
+                    continue
+                
+                self.states[path] = _DONE
+                self.results[path] = result
+                self.cond.notify_all()
+            
+            if not isinstance(result, OSError):
+                self._queue_subdirs(path, result)
+    
+    def _list(self, path):
+        entries = []
+        
+        if hasattr(os, 'scandir'):
+            for entry in os.scandir(path):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    st = None
+                entries.append( (entry.name, st, entry.is_symlink(), entry.inode()) )
+            
+            return entries
+        
+        for name in os.listdir(path):
+            fullname = join(path, name)
+            try:
+                lst = os.lstat(fullname)
+            except OSError:
+                entries.append( (name, None, False, 0) )
+                continue
+            
+            if stat.S_ISLNK(lst.st_mode):
+                try:
+                    st = os.stat(fullname)
+                except OSError:
+                    st = None
+                entries.append( (name, st, True, lst.st_ino) )
+            else:
+                entries.append( (name, lst, False, lst.st_ino) )
+        
+        return entries
+    
+    def _queue_subdirs(self, path, entries):
+        subdirs = []
+        for name, st, is_link, ino in entries:
+            if st is None or not stat.S_ISDIR(st.st_mode):
+                continue
+            
+            # only followed symlinks are walked into
+            if is_link and self.links != L_FOLLOW_ALL:
+                continue
+            
+            fullname = join(path, name)
+            if not _is_excluded(fullname, self.excludes):
+                subdirs.append(fullname)
+        
+        with self.cond:
+            if self.closed or self._pruned(path):
+                return
+            
+            subdirs = [p for p in subdirs if p not in self.states]
+            del subdirs[max(self.limit - len(self.states), 0):]
+            
+            for fullname in reversed(subdirs):
+                self.states[fullname] = _QUEUED
+                self.parents[fullname] = path
+                self.stack.append(fullname)
+            
+            if subdirs:
+                self.cond.notify_all()
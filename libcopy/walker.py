@@ -17,18 +17,27 @@
 
 
 # standard imports
+import errno
 import os
 import sys
 
 from os import mkdir
-from os.path import exists, getsize
+from os.path import (basename, curdir, dirname, exists, getsize, join,
+                    lexists, relpath)
 from shutil import copystat
 
 # local imports
-from .copy import copyfile, copylink, Error
-from .walk import (NOSTAT, IGNORE, EXCLUDE,
-                    REG, DIR, LINK, HARDLINK, BLOCK, CHAR, PIPE, SOCK,
-                    walk)
+from .copy import (copydevice, copyfile, copylink, copynode, copystat_dir,
+                    Error)
+from .linux import devicesize
+from .walk import (NOSTAT, IGNORE, EXCLUDE, NOLIST,
+                    REG, DIR, LINK, HARDLINK, BLOCK, CHAR, PIPE, SOCK)
+
+def _mtime(st):
+    # float seconds can't tell apart all nanosecond timestamps
+    if hasattr(st, 'st_mtime_ns'):
+        return st.st_mtime_ns
+    return st.st_mtime
 
 class PathWalker(object):
     """Feeds jobs to the jobQ and counts bytes to copy."""
@@ -40,14 +49,12 @@ class PathWalker(object):
     
         self.actions = {}
         self.default_action = None
+        
+        # additional keywords for walk()
+        self.walk_options = {}
     
     def run(self):
-        for result in walk(*self.options.sources,
-            target=self.options.target,
-            recurse=self.options.recurse,
-            excludes=self.options.excludes,
-            links=self.options.links):
-            
+        for result in self.manager.walk(**self.walk_options):
             type, top, src, dst = result
             
             action = self.actions.get(type, self.default_action)
@@ -57,7 +64,7 @@ class PathWalker(object):
     def execute(self, func, type, top, src, dst):
         try:
             func(type, top, src, dst)
-        except Error as e:
+        except (Error, EnvironmentError) as e:
             self.logger.error( str(e) )
 
 
@@ -65,12 +72,20 @@ class FilesizeWalker(PathWalker):
     def __init__(self, *args, **kwargs):
         super(FilesizeWalker, self).__init__(*args, **kwargs)
         
-        self.actions = { REG : self.file_action }
+        self.actions = { REG : self.file_action, BLOCK : self.device_action }
         self.bytes_total = 0
     
     def file_action(self, type, top, src, dst):
         self.bytes_total += getsize(src)
     
+    def device_action(self, type, top, src, dst):
+        if not self.options.devices:
+            try:
+                self.bytes_total += devicesize(src)
+            except EnvironmentError:
+                # reported by the CopyWalker
+                pass
+    
     def run(self):
         super(FilesizeWalker, self).run()
         self.logger.set_total(self.bytes_total)
@@ -82,6 +97,7 @@ class CopyWalker(PathWalker):
 
         self.actions = {    # errors
                             NOSTAT : self.error_action,
+                            NOLIST : self.error_action,
                             IGNORE : self.error_action,
                             
                             # directories
@@ -89,10 +105,12 @@ class CopyWalker(PathWalker):
                             
                             # 'regular files'
                             REG         : self.file_action,
-                            BLOCK       : self.file_action,
-                            CHAR        : self.file_action,
-                            PIPE        : self.file_action,
-                            SOCK        : self.file_action,
+                            BLOCK       : self.device_action,
+                            CHAR        : self.device_action,
+                            
+                            # special files
+                            PIPE        : self.node_action,
+                            SOCK        : self.node_action,
                             
                             # links
                             HARDLINK    : self.link_action,
@@ -100,6 +118,35 @@ class CopyWalker(PathWalker):
                         }
                         
         self.interactive_list = []
+        
+        # -p: (src, dst, stat result) of created directories, their
+        # metadata is copied after their contents have been written
+        self.created_dirs = []
+        
+        # --move: directories to remove after the walk and
+        # (st_dev, st_ino) -> dst of moved files with several links
+        self.prune = set()
+        self.moved_dirs = []
+        self.moved_inodes = {}
+        
+        if self.options.move:
+            self.walk_options = { 'hardlinks' : False, 'prune' : self.prune }
+        
+        # Renaming a directory moves everything below it - excluded and
+        # filtered entries too. With those, entries are moved one by one.
+        self.rename_dirs = not self.options.excludes and self.manager.filter is None
+        
+        # --watch: the destinations of all jobs, so that only what was
+        # copied is removed (see Watcher.remove_extra())
+        self.copied = None
+    
+    def execute(self, func, type, top, src, dst):
+        self.manager.throttle.consume_files()
+        super(CopyWalker, self).execute(func, type, top, src, dst)
+        
+        # negative types are errors
+        if self.copied is not None and type > 0:
+            self.copied.add(dst)
     
     def error_action(self, type, top, src, dst):
         if type == NOSTAT:
@@ -107,19 +154,59 @@ class CopyWalker(PathWalker):
                 
         elif type == IGNORE:
             self.logger.error("omitting directory '%s'" % src)
+        
+        elif type == NOLIST:
+            # walk() doesn't tell why - ask again
+            try:
+                os.listdir(src)
+            except OSError as e:
+                reason = e.strerror
+            else:
+                reason = 'it changed while reading it'
+            self.logger.error("cannot read directory '%s': %s" % (src, reason) )
     
     def dir_action(self, type, top, src, dst):
+        if (self.options.move and self.rename_dirs and
+                self.rename_if_possible(src, dst)):
+            # the whole subtree has been moved
+            self.prune.add(src)
+            return
+        
         if not exists(dst):
             mkdir(dst)
-            self.copystat_if_wanted(src, dst)           
+            
+            if self.options.preserve_attributes:
+                self.created_dirs.append( (src, dst, os.stat(src)) )
+        
+        if self.options.move:
+            self.moved_dirs.append(src)
                     
     def link_action(self, type, top, src, dst):
         if type == HARDLINK:
             copylink(src, dst, force=self.options.force, hardlink=True)
-            self.copystat_if_wanted(src, dst)
+        elif type == LINK and self.options.move:
+            if not self.rename_if_possible(src, dst):
+                copylink(src, dst, force=self.options.force, hardlink=False)
+                os.unlink(src)
         elif type == LINK:
             copylink(src, dst, force=self.options.force, hardlink=False)
 
+    def device_action(self, type, top, src, dst):
+        if self.options.devices:
+            self.node_action(type, top, src, dst)
+        else:
+            self.file_action(type, top, src, dst)
+    
+    def node_action(self, type, top, src, dst):
+        if self.options.move and self.rename_if_possible(src, dst):
+            return
+        
+        copynode(src, dst, force=self.options.force)
+        self.copystat_if_wanted(src, dst)
+        
+        if self.options.move:
+            os.unlink(src)
+    
     def file_action(self, type, top, src, dst):
         if exists(dst) and self.options.interactive:
             self.interactive_list.append( (type, top, src, dst) )
@@ -127,13 +214,142 @@ class CopyWalker(PathWalker):
             self._real_file_action(type, top, src, dst)
 
     def _real_file_action(self, type, top, src, dst):
+        if self.options.move:
+            self._move_file(type, top, src, dst)
+            return
+        
+        if type == REG and self.options.link_dest:
+            reference = self.find_unchanged(src, dst)
+            if reference:
+                try:
+                    copylink(reference, dst, force=self.options.force, hardlink=True)
+                    return
+                except Error:
+                    raise
+                except OSError:
+                    # e.g. EXDEV or EMLINK - like rsync, copy the file instead
+                    pass
+        
+        self.copy_data(type, src, dst)
+    
+    def copy_data(self, type, src, dst):
+        profile = self.manager.tuner.select(src, dst)
+        throttle = self.manager.throttle
+        
         self.logger.start_copy(src, dst)
         
-        copyfile(src, dst, resume=self.options.resume,
-            force=self.options.force, callback=self.logger.update_copy)
-        self.copystat_if_wanted(src, dst)
+        if type == BLOCK:
+            # O_DIRECT needs blocks aligned to the page size
+            copydevice(src, dst, length=throttle.chunk_size(1024**2, align=4096),
+                direct=self.options.direct and profile.direct,
+                resume=self.options.resume, force=self.options.force,
+                callback=self.logger.update_copy, throttle=throttle.consume_bytes)
+            self.copystat_if_wanted(src, dst)
+        else:
+            copyfile(src, dst, length=throttle.chunk_size(profile.length),
+                resume=self.options.resume,
+                force=self.options.force, callback=self.logger.update_copy,
+                throttle=throttle.consume_bytes,
+                engine=profile.engine,
+                preserve=self.options.preserve_attributes)
         
         self.logger.finish_copy(src, dst)
+    
+    def _move_file(self, type, top, src, dst):
+        if self.rename_if_possible(src, dst):
+            return
+        
+        # copy, verify and unlink - until the source is unlinked,
+        # there's always a complete file at src.
+        st = os.lstat(src)
+        key = (st.st_dev, st.st_ino)
+        
+        if key in self.moved_inodes:
+            copylink(self.moved_inodes[key], dst, force=self.options.force,
+                hardlink=True)
+        else:
+            self.copy_data(type, src, dst)
+            
+            if type == REG and os.lstat(dst).st_size != st.st_size:
+                raise Error("'%s' differs from '%s' after copying, not removing it" % (dst, src))
+            
+            if st.st_nlink > 1:
+                self.moved_inodes[key] = dst
+        
+        os.unlink(src)
+    
+    def find_unchanged(self, src, dst):
+        """Returns an unchanged copy of src in the --link-dest directories.
+        
+        A file is unchanged, if size, mtime and mode match. The file is
+        looked up by the path of dst relative to the target. Returns
+        None, if there's no such file.
+        """
+        
+        # pairs read by --files-from have no common target
+        if self.options.target is None:
+            return None
+        
+        rel = relpath(dst, self.options.target)
+        if rel == curdir:
+            rel = basename(dst)
+        
+        st = os.stat(src)
+        for directory in self.options.link_dest:
+            reference = join(directory, rel)
+            try:
+                ref_st = os.lstat(reference)
+            except OSError:
+                continue
+            
+            if (ref_st.st_mode == st.st_mode and
+                ref_st.st_size == st.st_size and
+                _mtime(ref_st) == _mtime(st)):
+                return reference
+        
+        return None
+    
+    def rename_if_possible(self, src, dst):
+        """Rename src to dst if both are on the same filesystem.
+        
+        Returns True, if src has been renamed. Existing destinations are
+        never replaced.
+        """
+        
+        if lexists(dst):
+            return False
+        
+        if os.lstat(src).st_dev != os.stat(dirname(dst) or '.').st_dev:
+            return False
+        
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # e.g. a mount point within src
+            return False
+        
+        self.logger.rename(src, dst)
+        return True
+    
+    def copy_dir_stats(self):
+        # bottom up - after the contents of a directory are complete
+        for src, dst, st in reversed(self.created_dirs):
+            try:
+                copystat_dir(src, dst, st=st)
+            except EnvironmentError as e:
+                self.logger.error("cannot preserve attributes of '%s': %s" % (dst, e.strerror) )
+        
+        self.created_dirs = []
+    
+    def remove_moved_dirs(self):
+        # bottom up - a directory is removed after its contents
+        for src in reversed(self.moved_dirs):
+            try:
+                os.rmdir(src)
+            except OSError as e:
+                # excluded or failed files stay where they are
+                if e.errno != errno.ENOTEMPTY:
+                    self.logger.error("cannot remove '%s': %s" % (src, e.strerror) )
 
     def handle_interactive(self):
         for type, top, src, dst in self.interactive_list:
@@ -144,6 +360,10 @@ class CopyWalker(PathWalker):
     def run(self):
         super(CopyWalker, self).run()
         self.handle_interactive()
+        self.copy_dir_stats()
+        
+        if self.options.move:
+            self.remove_moved_dirs()
 
     def copystat_if_wanted(self, src, dst):
         if self.options.preserve_attributes:
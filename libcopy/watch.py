@@ -0,0 +1,292 @@
+# Copyright (C) 2013-2014 Maik Messerschmidt
+
+# This file is part of copy.
+
+# copy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# copy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with copy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep a copy up to date by replaying inotify events."""
+
+# standard imports
+import os
+import shutil
+import time
+
+from os.path import isdir, islink, join, lexists, sep
+
+# local imports
+from .inotify import (Inotify, IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE,
+                    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE,
+                    IN_DELETE_SELF, IN_Q_OVERFLOW, IN_IGNORED,
+                    IN_DONT_FOLLOW, IN_ISDIR)
+from .walk import (ModeError, COPY_NEW_DIR, DIR, REG, walk_pairs,
+                    _compose_dst, _detect_mode)
+
+WATCH_MASK = (  IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+                IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+                IN_DELETE_SELF | IN_DONT_FOLLOW )
+
+# kinds of pending changes
+ENTRY   = 1     # the entry itself changed (or vanished)
+TREE    = 2     # the entry and everything below it is new
+
+class Watcher(object):
+    """Mirrors changes below the sources to the target after the copy.
+
+    The watcher is meant to be the last worker of a CopyManager. It
+    replays the changed paths through the actions of the CopyWalker.
+    Events are collected until there were none for debounce seconds or
+    the oldest one is max_delay seconds old. If the kernel's event queue
+    overflows, the sources are rescanned.
+    """
+
+    def __init__(self, manager, walker, debounce=0.5, max_delay=5.0):
+        self.manager = manager
+        self.walker = walker
+        self.logger = manager.logger
+        self.options = manager.options
+
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        # The mode has to be detected before the copy creates the
+        # target. Errors are reported by the CopyWalker.
+        try:
+            self.mode = _detect_mode(*self.options.sources,
+                                    target=self.options.target)
+        except ModeError:
+            self.mode = None
+
+        self.inotify = None
+        self.watches = {}       # wd -> (path, top)
+        self.pending = {}       # path -> (top, kind)
+        self.renames = []       # (old top, old path, top, path)
+        self.moves = {}         # cookie -> (top, path) of IN_MOVED_FROM
+        self.first_event = None
+        self.overflow = False
+
+        # the walker records what it copies from here on
+        self.walker.copied = set()
+
+    def run(self):
+        if self.mode is None:
+            return
+
+        self.inotify = Inotify()
+        try:
+            # catch up with changes made during the initial copy
+            for top in self.options.sources:
+                self.replay(top, top, TREE, sync=True)
+            self.walker.copy_dir_stats()
+
+            self.loop()
+        finally:
+            self.inotify.close()
+
+    def loop(self):
+        while 1:
+            if self.first_event is None:
+                timeout = None
+            else:
+                timeout = self.debounce
+
+            events = self.inotify.read(timeout)
+            for event in events:
+                self.handle_event(event)
+
+            if self.first_event is None:
+                continue
+
+            if not events or time.time() - self.first_event >= self.max_delay:
+                self.flush()
+
+    def handle_event(self, event):
+        if event.mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            self._mark_time()
+            return
+
+        if event.wd not in self.watches:
+            return
+
+        path, top = self.watches[event.wd]
+        if event.mask & IN_IGNORED:
+            del self.watches[event.wd]
+            return
+
+        if event.name:
+            path = join(path, event.name)
+
+        self._mark_time()
+
+        if event.mask & IN_MOVED_FROM:
+            self.moves[event.cookie] = (top, path)
+
+        elif event.mask & IN_MOVED_TO and event.cookie in self.moves:
+            old_top, old_path = self.moves.pop(event.cookie)
+            self.renames.append( (old_top, old_path, top, path) )
+            self._rename_pending(old_path, path, top)
+
+        elif event.mask & (IN_MOVED_TO | IN_CREATE) and event.mask & IN_ISDIR:
+            self._add_pending(path, top, TREE)
+
+        else:
+            self._add_pending(path, top, ENTRY)
+
+    def _mark_time(self):
+        if self.first_event is None:
+            self.first_event = time.time()
+
+    def _add_pending(self, path, top, kind):
+        old_kind = self.pending.get(path, (top, 0))[1]
+        self.pending[path] = (top, max(kind, old_kind))
+
+    def _rename_pending(self, old_path, path, top):
+        """Moves pending changes and watches below old_path to path."""
+
+        def renamed(p):
+            if p == old_path:
+                return path
+            elif p.startswith(old_path + sep):
+                return path + p[len(old_path):]
+            return None
+
+        for p in list(self.pending):
+            new = renamed(p)
+            if new:
+                self.pending[new] = (top, self.pending.pop(p)[1])
+
+        for wd, (p, t) in list(self.watches.items()):
+            new = renamed(p)
+            if new:
+                self.watches[wd] = (new, top)
+
+    def flush(self):
+        backlog = len(self.pending) + len(self.renames) + len(self.moves)
+
+        if self.overflow:
+            for top in self.options.sources:
+                self.replay(top, top, TREE, sync=True)
+
+        else:
+            # moved out of the tree - i.e. deleted
+            for top, path in self.moves.values():
+                self._add_pending(path, top, ENTRY)
+
+            for old_top, old_path, top, path in self.renames:
+                self.replay_rename(old_top, old_path, top, path)
+
+            # sorted, so that directories come before their contents
+            for path in sorted(self.pending):
+                top, kind = self.pending[path]
+                self.replay(path, top, kind)
+
+        self.walker.copy_dir_stats()
+        self.logger.watch_stats(backlog, time.time() - self.first_event)
+
+        self.pending = {}
+        self.renames = []
+        self.moves = {}
+        self.first_event = None
+        self.overflow = False
+
+    def replay(self, path, top, kind, sync=False):
+        """Replays path through the actions of the walker.
+
+        If sync is True, unchanged files are skipped and files missing
+        in the source are removed from the copy - if this run copied
+        them. Everything else in the target is left alone.
+        """
+
+        dst = _compose_dst(top, path, self.options.target, mode=self.mode)
+
+        if not lexists(path):
+            self.remove(dst)
+            return
+
+        options = self.manager.walk_options()
+        if kind == TREE:
+            prune = ()
+        else:
+            # nothing to list for the threads
+            prune = set([path])
+            options['threads'] = 0
+
+        for type, t, src, d in walk_pairs([(path, dst)], mode=COPY_NEW_DIR,
+                                prune=prune, **options):
+
+            if type == DIR:
+                self.add_watch(src, top)
+                if sync:
+                    self.remove_extra(src, d)
+
+            if sync and type == REG and self.is_unchanged(src, d):
+                continue
+
+            action = self.walker.actions.get(type, self.walker.default_action)
+            if action:
+                self.walker.execute(action, type, top, src, d)
+
+        if not isdir(path):
+            self.add_watch(path, top)
+
+    def replay_rename(self, old_top, old_path, top, path):
+        old_dst = _compose_dst(old_top, old_path, self.options.target, mode=self.mode)
+        dst = _compose_dst(top, path, self.options.target, mode=self.mode)
+
+        try:
+            os.rename(old_dst, dst)
+        except OSError:
+            # e.g. the old name has never been copied
+            self._add_pending(path, top, TREE)
+
+    def add_watch(self, path, top):
+        # only top level files are watched on their own
+        if path != top and not isdir(path):
+            return
+
+        try:
+            wd = self.inotify.add_watch(path, WATCH_MASK)
+        except OSError as e:
+            self.logger.error("cannot watch '%s': %s" % (path, e.strerror) )
+        else:
+            self.watches[wd] = (path, top)
+
+    def remove(self, dst):
+        try:
+            if isdir(dst) and not islink(dst):
+                shutil.rmtree(dst)
+            elif lexists(dst):
+                os.unlink(dst)
+        except EnvironmentError as e:
+            self.logger.error("cannot remove '%s': %s" % (dst, e) )
+
+    def remove_extra(self, src, dst):
+        if not isdir(dst):
+            return
+
+        for name in set(os.listdir(dst)) - set(os.listdir(src)):
+            path = join(dst, name)
+            if path in self.walker.copied:
+                self.walker.copied.discard(path)
+                self.remove(path)
+
+    def is_unchanged(self, src, dst):
+        try:
+            src_st = os.stat(src)
+            dst_st = os.stat(dst)
+        except OSError:
+            return False
+
+        return (src_st.st_size == dst_st.st_size and
+                dst_st.st_mtime >= src_st.st_mtime)